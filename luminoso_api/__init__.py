@@ -1,7 +1,45 @@
+import importlib
+
 from .errors import *
-from .v5_client import LuminosoClient as V5LuminosoClient
+from . import errors, version
 from .version import VERSION
 
-LuminosoClient = V5LuminosoClient
 name = "luminoso-api"
 __version__ = VERSION
+
+# The client (and with it, the requests library) is only imported when it's
+# first asked for, so that command-line tools such as `lumi-api --help` start
+# quickly.  These are the names that importing it used to provide.
+_CLIENT_NAMES = ('LuminosoClient', 'V5LuminosoClient')
+__all__ = [  # noqa: F405 (some names are loaded by __getattr__)
+    attr for attr in vars(errors) if attr.startswith('Luminoso')
+] + list(_CLIENT_NAMES) + [
+    'VERSION', 'name', 'errors', 'version', 'v5_client', 'v5_constants'
+]
+
+
+def __getattr__(attr):
+    missing = AttributeError(
+        'module %r has no attribute %r' % (__name__, attr)
+    )
+    if attr in _CLIENT_NAMES:
+        from .v5_client import LuminosoClient as value
+    elif attr.startswith('_'):
+        raise missing
+    else:
+        # Submodules, such as luminoso_api.v5_client, are available as
+        # attributes after `import luminoso_api`, as they were when the
+        # client was imported eagerly
+        try:
+            value = importlib.import_module('.' + attr, __name__)
+        except ModuleNotFoundError as e:
+            if e.name != __name__ + '.' + attr:
+                raise
+            raise missing from None
+    # Don't look it up again next time
+    globals()[attr] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
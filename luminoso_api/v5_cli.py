@@ -1,17 +1,13 @@
 import argparse
 import csv
+import io
 import json
 import os
 import sys
 from signal import signal, SIGPIPE, SIG_DFL
 
-from .v5_client import LuminosoClient
 from .v5_constants import URL_BASE
 
-# Python raises IOError when reading process (such as `head`) closes a pipe.
-# Setting SIG_DFL as the SIGPIPE handler prevents this program from crashing.
-signal(SIGPIPE, SIG_DFL)
-
 
 DESCRIPTION = "Access the Luminoso API via the command line."
 
@@ -44,26 +40,63 @@ def _print_csv(result):
     if type(result) is not list:
         raise TypeError("output not able to be displayed as CSV.")
     first_line = result[0]
-    w = csv.DictWriter(sys.stdout, fieldnames=sorted(first_line.keys()))
+    fieldnames = sorted(first_line.keys())
+    # stdout can be a text-only stream, such as in IDLE or Jupyter, or when
+    # it's redirected to a StringIO; then we just write to it
+    if getattr(sys.stdout, 'buffer', None) is None:
+        _write_csv(sys.stdout, fieldnames, result)
+        return
+    # Otherwise, write to stdout's underlying binary stream through our own
+    # text layer, which is block-buffered even when stdout is a terminal, and
+    # which doesn't translate the csv module's line endings a second time
+    sys.stdout.flush()
+    out = io.TextIOWrapper(sys.stdout.buffer, encoding=sys.stdout.encoding,
+                           errors=sys.stdout.errors, newline='')
+    try:
+        _write_csv(out, fieldnames, result)
+    finally:
+        out.flush()
+        # Detach, so that sys.stdout's stream isn't closed along with ours
+        out.detach()
+
+
+def _write_csv(out, fieldnames, rows):
+    """Write a header and rows of dictionaries as CSV to a text stream."""
+    w = csv.DictWriter(out, fieldnames=fieldnames)
     w.writeheader()
-    for line in result:
-        w.writerow(line)
+    w.writerows(rows)
+
+
+def positive_int(value):
+    """
+    An argparse type for arguments, such as numbers of workers, that must be
+    a whole number greater than zero.
+    """
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(
+            '%r is not a positive integer' % value
+        )
+    return number
 
 
 def _read_params(input_file, json_body, p_params):
     """Read parameters from input file, -j, and -p arguments, in that order."""
+    # This uses orjson, if it's installed, to read large input files quickly
+    from .v5_client import json_loads
     params = {}
     try:
         if input_file:
-            params.update(json.load(input_file))
+            params.update(json_loads(input_file.read()))
         if json_body is not None:
-            params.update(json.loads(json_body))
+            params.update(json_loads(json_body))
     except ValueError as e:
         raise ValueError("input is not valid JSON: %s" % e)
-    try:
-        params.update({p.split('=', 1)[0]: p.split('=', 1)[1] for p in p_params})
-    except IndexError:
-        raise ValueError("--param arguments must have key=value format")
+    for p in p_params:
+        key, sep, value = p.partition('=')
+        if not sep:
+            raise ValueError("--param arguments must have key=value format")
+        params[key] = value
     return params
 
 
@@ -87,6 +120,9 @@ def _main(*vargs):
     parser.add_argument('input_file', nargs='?', type=open)
 
     args = parser.parse_args(vargs)
+    # Import the client only once the arguments are known to be good, so
+    # that `--help` and usage errors don't wait for it to load
+    from .v5_client import LuminosoClient
     client = LuminosoClient.connect(
         url=args.base_url,
         token_file=args.token_file,
@@ -109,6 +145,10 @@ def _main(*vargs):
 
 
 def main():
+    # Python raises IOError when reading process (such as `head`) closes a
+    # pipe.  Setting SIG_DFL as the SIGPIPE handler prevents this program from
+    # crashing.
+    signal(SIGPIPE, SIG_DFL)
     try:
         _main(*sys.argv[1:])
     except Exception as e:
@@ -2,12 +2,19 @@
 Provides the LuminosoClient object, a wrapper for making
 properly-authenticated requests to the Luminoso REST API.
 """
+import functools
+import gzip
 import json
 import logging
 import os
 import requests
+import tempfile
+import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from getpass import getpass
+from itertools import islice
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
 from urllib.parse import urlparse
@@ -17,8 +24,36 @@ from .errors import (LuminosoError, LuminosoAuthError, LuminosoClientError,
                      LuminosoServerError, LuminosoTimeoutError)
 from .version import VERSION
 
+# orjson is an optional dependency that encodes and decodes JSON much faster
+# than the standard library; use it if it's installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 logger = logging.getLogger(__name__)
 
+# How many connections to each host a client's session will keep open
+POOL_MAXSIZE = 32
+# Sessions made by connect(share_session=True), keyed by the API's host and
+# the token, so that clients connected separately to the same API can share
+# one connection pool; only the most recently made ones are kept
+_SESSIONS = {}
+_SESSIONS_LOCK = threading.Lock()
+MAX_SHARED_SESSIONS = 8
+# Responses that mean the server is briefly unavailable, how many times to
+# retry a request that gets one, and the longest to wait before each retry
+SERVER_ERROR_STATUSES = [502, 503, 504]
+MAX_SERVER_ERROR_RETRIES = 3
+MAX_SERVER_ERROR_WAIT = 30
+# How many request URLs each client will remember
+URL_CACHE_SIZE = 256
+# How large a JSON request body has to be, in bytes, before a client that
+# compresses requests will gzip it
+COMPRESS_MIN_BYTES = 4096
+# How many bytes of a download to write to a file at a time
+DOWNLOAD_CHUNK_SIZE = 1 << 16
+
 
 class LuminosoClient(object):
     """
@@ -50,32 +85,53 @@ class LuminosoClient(object):
     """
     _URL_BASE = URL_BASE
 
-    def __init__(self, session, url, user_agent_suffix=None, timeout=None):
+    def __init__(self, session, url, user_agent_suffix=None, timeout=None,
+                 root_url=None, compress=False):
         """
         Create a LuminosoClient given an existing Session object that has a
         _TokenAuth object as its .auth attribute.
 
+        If `compress` is True, large JSON bodies of POST, PUT, and PATCH
+        requests are sent gzip-compressed.
+
+        If the root URL for `url` is already known, it can be passed as
+        `root_url` to save working it out again.
+
         It is probably easier to call LuminosoClient.connect() to handle
         the authentication for you.
         """
         self.session = session
         self.timeout = timeout
+        self.compress = compress
         self.url = ensure_trailing_slash(url)
-        # Don't warn this time; warning happened in connect()
-        self.root_url = self.get_root_url(url, warn=False)
+        # Full URLs for the paths that requests have been made to, so that
+        # repeated requests don't have to rebuild them
+        self._url_cache = {}
+        if root_url is None:
+            # Don't warn this time; warning happened in connect()
+            root_url = self.get_root_url(url, warn=False)
+        self.root_url = root_url
         # Calculate the full user agent suffix, but also store the suffix so it
         # can be preserved by client_for_path().
         self._user_agent_suffix = user_agent_suffix
         self.user_agent = 'LuminosoClient/' + VERSION
         if user_agent_suffix is not None:
             self.user_agent += ' ' + user_agent_suffix
+        # The headers for requests without a body, and for requests with a
+        # JSON body, which are the same every time
+        self._headers = {'user-agent': self.user_agent}
+        self._json_headers = {'user-agent': self.user_agent,
+                              'Content-Type': 'application/json'}
+        self._gzip_json_headers = {**self._json_headers,
+                                   'Content-Encoding': 'gzip'}
 
     def __repr__(self):
         return '<LuminosoClient for %s>' % self.url
 
     @classmethod
     def connect(cls, url=None, token_file=None, token=None,
-                user_agent_suffix=None, timeout=None):
+                user_agent_suffix=None, timeout=None, compress=False,
+                share_session=False):
         """
         Returns an object that makes requests to the API, authenticated
         with a saved or specified long-lived token, at URLs beginning with
@@ -94,6 +150,16 @@ class LuminosoClient(object):
         "LuminosoClient" and the version number.  You can optionally pass a
         string to be appended to this, though for most uses of the client this
         is unnecessary.
+
+        If `compress` is True, the JSON bodies of large POST, PUT, and PATCH
+        requests, such as document uploads, will be sent gzip-compressed,
+        which saves bandwidth on slow connections.
+
+        Each call makes a new session, unless `share_session` is True: then
+        clients connected that way to the same API with the same token share
+        a session, so they reuse each other's open connections.  Changing
+        the settings of a shared session, or closing it, affects all of
+        those clients.
         """
         if url is None:
             url = '/'
@@ -107,12 +173,13 @@ class LuminosoClient(object):
         if token is None:
             token_file = token_file or get_token_filename()
             try:
-                with open(token_file) as tf:
-                    token_dict = json.load(tf)
+                token_dict = _read_token_file(token_file)
             except FileNotFoundError:
                 raise LuminosoAuthError('No token file at %s' % token_file)
 
-            netloc = urlparse(root_url).netloc
+            # The root URL is always of the form "scheme://netloc/api/v5",
+            # so there's no need to parse it again to get the netloc
+            netloc = root_url.split('/', 3)[2]
             try:
                 token = token_dict[netloc]
             except KeyError:
@@ -129,22 +196,12 @@ class LuminosoClient(object):
                 else:
                     raise LuminosoAuthError('No token stored for %s' % root_url)
 
-        session = requests.session()
-        session.auth = _TokenAuth(token)
-        # By default, requests will only retry things like connection timeouts,
-        # not any server responses.  We use urllib3's Retry class to say that,
-        # if a call failed specifically on a 429 ("too many requests"), wait a
-        # full second and try again.  (Technically it tries again immediately,
-        # but then it gets another 429 and tries again at twice the backoff
-        # factor.)  The total retries is 10, which is 256 seconds (four
-        # minutes, 16 seconds; or a cumulative wait of 8.5 minutes).
-        retry_strategy = Retry(total=10, backoff_factor=.5,
-                               status_forcelist=[429])
-        adapter = HTTPAdapter(max_retries=retry_strategy)
-        session.mount("https://", adapter)
-        session.mount("http://", adapter)
+        if share_session:
+            session = _shared_session(root_url, token)
+        else:
+            session = _new_session(token)
         return cls(session, url, user_agent_suffix=user_agent_suffix,
-                   timeout=timeout)
+                   timeout=timeout, compress=compress)
 
     @classmethod
     def save_token(cls, token=None, domain='daylight.luminoso.com',
@@ -210,36 +267,48 @@ class LuminosoClient(object):
             session.post(url.rstrip('/') + '/api/v5/logout/', headers=headers)
 
         token_file = token_file or get_token_filename()
-        if os.path.exists(token_file):
-            saved_tokens = json.load(open(token_file))
-        else:
+        try:
+            saved_tokens = _read_token_file(token_file)
+        except FileNotFoundError:
             saved_tokens = {}
         saved_tokens[domain] = token
         directory, filename = os.path.split(token_file)
-        if directory and not os.path.exists(directory):
-            os.makedirs(directory)
-        with open(token_file, 'w') as f:
-            json.dump(saved_tokens, f)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Write the tokens to a temporary file and then move it into place, so
+        # that a crash or a concurrent save can't leave the file half-written
+        with tempfile.NamedTemporaryFile('wb', dir=directory or '.',
+                                         prefix=filename, suffix='.tmp',
+                                         delete=False) as f:
+            try:
+                f.write(json_dumps(saved_tokens))
+            except BaseException:
+                f.close()
+                os.remove(f.name)
+                raise
+        os.replace(f.name, token_file)
 
     def _request(self, req_type, url, **kwargs):
         """
         Make a request via the `requests` module. If the result has an HTTP
         error status, convert that to a Python exception.
         """
-        kwargs.setdefault('headers', {})['user-agent'] = self.user_agent
+        # Our own methods pass headers that already include the user agent
+        headers = kwargs.setdefault('headers', self._headers)
+        if 'user-agent' not in headers:
+            kwargs['headers'] = {**headers, 'user-agent': self.user_agent}
         if self.timeout is not None:
             kwargs['timeout'] = self.timeout
-        logger.debug('%s %s' % (req_type, url))
+        logger.debug('%s %s', req_type, url)
         try:
             result = self.session.request(req_type, url, **kwargs)
             try:
                 result.raise_for_status()
             except requests.HTTPError:
-                error = result.text
                 try:
-                    error = json.loads(error)
+                    error = json_loads(result.content)
                 except ValueError:
-                    pass
+                    error = result.text
                 if result.status_code in (401, 403):
                     error_class = LuminosoAuthError
                 elif result.status_code in (400, 404, 405):
@@ -248,9 +317,13 @@ class LuminosoClient(object):
                     error_class = LuminosoServerError
                 else:
                     error_class = LuminosoError
-                raise error_class(error)
-        except requests.Timeout:
-            raise LuminosoTimeoutError()
+                exception = error_class(error)
+                # Let callers that retry requests tell which failures are
+                # safe to retry
+                exception.status_code = result.status_code
+                raise exception
+        except requests.Timeout as e:
+            raise LuminosoTimeoutError() from e
         return result
 
     def _json_request(self, req_type, url, **kwargs):
@@ -258,14 +331,58 @@ class LuminosoClient(object):
         Make a request of the specified type and expect a JSON object in
         response.
         """
-        response = self._request(req_type, url, **kwargs)
+        return self._decode_json(self._request(req_type, url, **kwargs))
+
+    @staticmethod
+    def _decode_json(response):
+        """
+        Get the JSON object in the body of a response, raising a
+        LuminosoError if there isn't one.
+        """
         try:
-            json_response = response.json()
+            return json_loads(response.content)
         except ValueError:
-            logger.error("Received response with no JSON: %s %s" %
-                         (response, response.content))
+            logger.error("Received response with no JSON: %s %s",
+                         response, response.content)
             raise LuminosoError('Response body contained no JSON.')
-        return json_response
+
+    def _url_for(self, path):
+        """
+        Get the full URL, with a trailing slash, for a path relative to this
+        client's URL.
+        """
+        try:
+            return self._url_cache[path]
+        except KeyError:
+            url = ensure_trailing_slash(self.url + path.lstrip('/'))
+            # Don't let the cache grow without bound when a caller makes
+            # requests to many different paths, such as individual documents
+            if len(self._url_cache) < URL_CACHE_SIZE:
+                self._url_cache[path] = url
+            return url
+
+    def _compress_body(self, data):
+        """
+        Gzip a request body if this client compresses requests and the body
+        is large enough to be worth it.  Returns the body to send and its
+        Content-Encoding, or None if it wasn't compressed.
+        """
+        if self.compress and len(data) >= COMPRESS_MIN_BYTES:
+            # Compression level 1 gets most of the size reduction on text for
+            # a small fraction of the CPU time of the default level
+            return gzip.compress(data, compresslevel=1), 'gzip'
+        return data, None
+
+    def _json_body(self, params):
+        """
+        Encode parameters as the JSON body of a request, compressed as
+        described in _compress_body.  Returns the body and the headers to
+        send with it.
+        """
+        data, content_encoding = self._compress_body(json_dumps(params))
+        if content_encoding is None:
+            return data, self._json_headers
+        return data, self._gzip_json_headers
 
     # Simple REST operations
     def get(self, path='', **params):
@@ -279,7 +396,7 @@ class LuminosoClient(object):
         anything on the server.
         """
         params = jsonify_parameters(params)
-        url = ensure_trailing_slash(self.url + path.lstrip('/'))
+        url = self._url_for(path)
         return self._json_request('get', url, params=params)
 
     def post(self, path='', **params):
@@ -293,9 +410,9 @@ class LuminosoClient(object):
         POST requests are requests that cause a change on the server,
         especially those that ask to create and return an object of some kind.
         """
-        url = ensure_trailing_slash(self.url + path.lstrip('/'))
-        return self._json_request('post', url, data=json.dumps(params),
-                                  headers={'Content-Type': 'application/json'})
+        url = self._url_for(path)
+        data, headers = self._json_body(params)
+        return self._json_request('post', url, data=data, headers=headers)
 
     def put(self, path='', **params):
         """
@@ -308,9 +425,9 @@ class LuminosoClient(object):
         PUT requests are usually requests to *update* the object represented by
         this URL. Unlike POST requests, PUT requests can be safely duplicated.
         """
-        url = ensure_trailing_slash(self.url + path.lstrip('/'))
-        return self._json_request('put', url, data=json.dumps(params),
-                                  headers={'Content-Type': 'application/json'})
+        url = self._url_for(path)
+        data, headers = self._json_body(params)
+        return self._json_request('put', url, data=data, headers=headers)
 
     def patch(self, path='', **params):
         """
@@ -323,9 +440,9 @@ class LuminosoClient(object):
         PATCH requests are usually requests to make *small fixes* to the
         object represented by this URL.
         """
-        url = ensure_trailing_slash(self.url + path.lstrip('/'))
-        return self._json_request('patch', url, data=json.dumps(params),
-                                  headers={'Content-Type': 'application/json'})
+        url = self._url_for(path)
+        data, headers = self._json_body(params)
+        return self._json_request('patch', url, data=data, headers=headers)
 
     def delete(self, path='', **params):
         """
@@ -337,9 +454,34 @@ class LuminosoClient(object):
         DELETE requests ask to delete the object represented by this URL.
         """
         params = jsonify_parameters(params)
-        url = ensure_trailing_slash(self.url + path.lstrip('/'))
+        url = self._url_for(path)
         return self._json_request('delete', url, params=params)
 
+    def post_data(self, path, data, content_type, content_encoding=None,
+                  **params):
+        """
+        Make a POST request to the given path, with `data` as its body, and
+        return the JSON-decoded result.
+
+        `data` should already be encoded as bytes, and `content_type` should
+        be its MIME type, such as 'application/json'.  If the data has been
+        compressed, `content_encoding` should say how, such as 'gzip'.
+        Otherwise, if this client compresses requests, a large body is
+        gzip-compressed before it's sent.
+
+        Keyword parameters will be converted to URL parameters.
+        """
+        params = jsonify_parameters(params)
+        url = self._url_for(path)
+        if content_encoding is None:
+            data, content_encoding = self._compress_body(data)
+        headers = {'user-agent': self.user_agent,
+                   'Content-Type': content_type}
+        if content_encoding is not None:
+            headers['Content-Encoding'] = content_encoding
+        return self._json_request('post', url, params=params, data=data,
+                                  headers=headers)
+
     # Useful abstractions
     def client_for_path(self, path):
         """
@@ -360,8 +502,10 @@ class LuminosoClient(object):
             url = self.root_url + path
         else:
             url = self.url + path
+        # All clients for paths under the same root share its root URL
         return self.__class__(
-            self.session, url, user_agent_suffix=self._user_agent_suffix
+            self.session, url, user_agent_suffix=self._user_agent_suffix,
+            root_url=self.root_url, compress=self.compress
         )
 
     def change_path(self, path):
@@ -381,38 +525,79 @@ class LuminosoClient(object):
         logger.warning('The upload method is deprecated; use post instead.')
         return self.post(path, docs=docs)
 
-    def wait_for_build(self, interval=5, path=None):
+    def post_bulk(self, path, docs, batch_size=1000, workers=1):
+        """
+        POST any number of documents to the given path, such as 'upload' on a
+        project client, as the `docs` parameter of as few requests as
+        possible: each request carries up to `batch_size` documents.
+
+        `docs` can be any iterable, such as a generator; it is read one batch
+        at a time.  Returns a list of the JSON-decoded results of the
+        requests, in order.
+
+        If `workers` is more than 1, up to that many requests are sent at the
+        same time, using map_in_threads.
+        """
+        docs = iter(docs)
+        batches = iter(lambda: list(islice(docs, batch_size)), [])
+        if workers <= 1:
+            return [self.post(path, docs=batch) for batch in batches]
+        return list(map_in_threads(
+            lambda batch: self.post(path, docs=batch), batches, workers
+        ))
+
+    def wait_for_build(self, interval=5, path=None, max_interval=60):
         """
         A convenience method designed to inform you when a project build has
         completed, not counting the post-build sentiment step.  This makes most
         API calls available, other than those requiring sentiment.
 
-        It polls the API every `interval` seconds until there is not a build
-        running.  At that point, it returns the "last_build_info" field of the
-        project record if the build succeeded, and raises a LuminosoError with
-        the field as its message if the build failed.
+        It polls the API until there is not a build running, first after
+        `interval` seconds and then half again as long after each poll, up to
+        every `max_interval` seconds.  (Set `max_interval` equal to `interval`
+        to poll at a fixed rate.)  At that point, it returns the
+        "last_build_info" field of the project record if the build succeeded,
+        and raises a LuminosoError with the field as its message if the build
+        failed.
 
         If a `path` is not specified, this method will assume that its URL is
         the URL for the project.  Otherwise, it will use the specified path
         (which should be "/projects/<project_id>/").
         """
-        return self._wait_for_build(interval=interval, path=path)
+        return self._wait_for_build(interval=interval, path=path,
+                                    max_interval=max_interval)
 
-    def wait_for_sentiment_build(self, interval=30, path=None):
+    def wait_for_sentiment_build(self, interval=30, path=None,
+                                 max_interval=60):
         """
         A convenience method designed to inform you when a project build has
         completed, including the sentiment build.  Otherwise identical to
         `wait_for_build`.
         """
         return self._wait_for_build(interval=interval, path=path,
-                                    wait_for_sentiment=True)
+                                    wait_for_sentiment=True,
+                                    max_interval=max_interval)
 
-    def _wait_for_build(self, interval=5, path=None, wait_for_sentiment=False):
-        path = path or ''
+    def _wait_for_build(self, interval=5, path=None, wait_for_sentiment=False,
+                        max_interval=60):
+        url = self._url_for(path or '')
+        max_interval = max(interval, max_interval)
         start = time.time()
         next_log = 0
+        etag = None
         while True:
-            response = self.get(path)['last_build_info']
+            # If the server tagged the project record, ask for it only if it
+            # has changed.  While the build runs it usually hasn't, and then
+            # the server can say so without sending the record again.
+            if etag is None:
+                result = self._request('get', url)
+            else:
+                result = self._request('get', url, headers={
+                    **self._headers, 'If-None-Match': etag
+                })
+            if result.status_code != 304:
+                etag = result.headers.get('ETag')
+                response = self._decode_json(result)['last_build_info']
             if not response:
                 raise ValueError('This project is not building!')
             if wait_for_sentiment and not response['sentiment']:
@@ -435,6 +620,9 @@ class LuminosoClient(object):
                 logger.info('Still waiting (%d seconds elapsed).', next_log)
                 next_log += 120
             time.sleep(interval)
+            # Quick builds are noticed quickly, while long builds aren't
+            # polled more often than they need to be
+            interval = min(interval * 1.5, max_interval)
 
     @staticmethod
     def _check_for_completion(status):
@@ -452,11 +640,20 @@ class LuminosoClient(object):
         filename = 'sample.xlsx'.
 
         Useful for downloading .xlsx files.
+
+        The content is written to the file as it arrives, so large downloads
+        don't have to fit in memory.
         """
-        url = ensure_trailing_slash(self.url + path.lstrip('/'))
-        content = self._request('get', url, params=params).content
-        with open(filename, 'wb') as f:
-            f.write(content)
+        url = self._url_for(path)
+        response = self._request('get', url, params=params, stream=True)
+        # Responses can't be used in a `with` statement in the older versions
+        # of requests that we support, so close this one ourselves
+        try:
+            with open(filename, 'wb') as f:
+                for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+        finally:
+            response.close()
 
     @staticmethod
     def get_root_url(url, warn=True):
@@ -464,23 +661,112 @@ class LuminosoClient(object):
         Get the "root URL" for a URL, as described in the LuminosoClient
         documentation.
         """
-        parsed_url = urlparse(url)
-
-        # Make sure it's a complete URL, not a relative one
-        if not parsed_url.scheme:
-            raise ValueError('Please supply a full URL, beginning with http://'
-                             ' or https:// .')
-
+        root_url, has_api_path = _parse_root_url(url)
         # Issue a warning if the path didn't already start with /api/v5
-        root_url = '%s://%s/api/v5' % (parsed_url.scheme, parsed_url.netloc)
-        if warn and not parsed_url.path.startswith('/api/v5'):
-            logger.warning('Using %s as the root url' % root_url)
+        if warn and not has_api_path:
+            logger.warning('Using %s as the root url', root_url)
         return root_url
 
 
 get_root_url = LuminosoClient.get_root_url
 
 
+@functools.lru_cache(maxsize=128)
+def _parse_root_url(url):
+    """
+    Get the root URL for a URL, and whether the URL's path already started
+    with /api/v5.  Every client computes its root URL, so the results are
+    cached.
+    """
+    parsed_url = urlparse(url)
+
+    # Make sure it's a complete URL, not a relative one
+    if not parsed_url.scheme:
+        raise ValueError('Please supply a full URL, beginning with http://'
+                         ' or https:// .')
+
+    root_url = '%s://%s/api/v5' % (parsed_url.scheme, parsed_url.netloc)
+    return root_url, parsed_url.path.startswith('/api/v5')
+
+
+def _shared_session(root_url, token):
+    """
+    Get the shared Session that makes requests to the API at `root_url` with
+    `token`, creating it the first time it's needed.
+    """
+    # The root URL is always of the form "scheme://netloc/api/v5"
+    key = (root_url.split('/', 3)[2], token)
+    with _SESSIONS_LOCK:
+        session = _SESSIONS.get(key)
+        if session is None:
+            # Forget the oldest session, so that a long-running program that
+            # rotates its tokens doesn't keep every old one alive
+            if len(_SESSIONS) >= MAX_SHARED_SESSIONS:
+                del _SESSIONS[next(iter(_SESSIONS))]
+            session = _SESSIONS[key] = _new_session(token)
+    return session
+
+
+class _Retry(Retry):
+    """
+    A Retry that gives up much sooner on a server that's unavailable than on
+    a rate limit.
+
+    A 502, 503, or 504 means the server is briefly unavailable, and a blip
+    shouldn't end a long download, so those are retried too, but only
+    MAX_SERVER_ERROR_RETRIES times, waiting at most MAX_SERVER_ERROR_WAIT
+    seconds each time (unless the server asks for longer with a Retry-After
+    header).  After that, the response is returned, so that _request raises
+    a LuminosoServerError for it.  urllib3 only retries error statuses for
+    methods that are safe to repeat, such as GET, PUT, and DELETE, so
+    uploads aren't repeated.
+    """
+    def _server_error_retries(self):
+        return sum(1 for attempt in self.history
+                   if attempt.status in SERVER_ERROR_STATUSES)
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if (status_code in SERVER_ERROR_STATUSES and
+                self._server_error_retries() >= MAX_SERVER_ERROR_RETRIES):
+            return False
+        return super().is_retry(method, status_code, has_retry_after)
+
+    def get_backoff_time(self):
+        backoff = super().get_backoff_time()
+        if self.history and self.history[-1].status in SERVER_ERROR_STATUSES:
+            return min(backoff, MAX_SERVER_ERROR_WAIT)
+        return backoff
+
+
+def _new_session(token):
+    """
+    Make a Session that authenticates with `token`, and retries requests
+    that were rate-limited.
+    """
+    session = requests.session()
+    session.auth = _TokenAuth(token)
+    # By default, requests will only retry things like connection timeouts,
+    # not any server responses.  We use urllib3's Retry class to say that,
+    # if a call failed specifically on a 429 ("too many requests"), wait a
+    # full second and try again.  (Technically it tries again immediately,
+    # but then it gets another 429 and tries again at twice the backoff
+    # factor.)  The total retries is 10, which is 256 seconds (four
+    # minutes, 16 seconds; or a cumulative wait of 8.5 minutes).
+    #
+    # GET, PUT, and DELETE requests are also retried a few times when they
+    # get a 502, 503, or 504; see _Retry.
+    retry_strategy = _Retry(total=10, backoff_factor=.5,
+                            status_forcelist=[429] + SERVER_ERROR_STATUSES)
+    # Keep enough connections open to the API that concurrent requests
+    # from several threads (such as lumi-upload's workers) can each
+    # reuse one, instead of opening and closing a new one per request.
+    adapter = HTTPAdapter(max_retries=retry_strategy,
+                          pool_maxsize=POOL_MAXSIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
 class _TokenAuth(requests.auth.AuthBase):
     """
     An object designed to attach to a requests.Session object to handle
@@ -488,12 +774,37 @@ class _TokenAuth(requests.auth.AuthBase):
     """
     def __init__(self, token):
         self.token = token
+        # Every request gets the same header, so build it just once
+        self._header = 'Token ' + token
 
     def __call__(self, request):
-        request.headers['Authorization'] = 'Token ' + self.token
+        request.headers['Authorization'] = self._header
         return request
 
 
+def _read_token_file(token_file):
+    """
+    Read the dictionary of saved tokens from a token file.
+
+    The contents are cached until the file changes, so that connecting many
+    clients in one process doesn't read and decode the file each time.
+    """
+    stat = os.stat(token_file)
+    # Return a copy, because save_token() modifies what it gets
+    return dict(_load_token_file(token_file, stat.st_ino, stat.st_mtime_ns,
+                                 stat.st_size))
+
+
+@functools.lru_cache(maxsize=8)
+def _load_token_file(token_file, inode, mtime_ns, size):
+    """
+    Read and decode a token file.  The arguments other than the filename are
+    only there so that a changed file isn't found in the cache.
+    """
+    with open(token_file, 'rb') as tf:
+        return json_loads(tf.read())
+
+
 def get_token_filename():
     """
     Return the default filename for storing API tokens.
@@ -506,18 +817,103 @@ def ensure_trailing_slash(url):
     Ensure that a URL has a slash at the end, which helps us avoid HTTP
     redirects.
     """
+    # Most URLs already end with exactly one slash
+    if url.endswith('/') and not url.endswith('//'):
+        return url
     return url.rstrip('/') + '/'
 
 
+def map_in_threads(func, iterable, workers=1):
+    """
+    Yield func(item) for each item in `iterable`, in order, making up to
+    `workers` calls at the same time in a pool of threads.
+
+    Items are only read from the iterable as workers free up, so a long
+    iterable, such as a generator of batches of documents, is never held in
+    memory all at once.  While the caller handles one result, the next
+    `workers` calls are already running, so even with one worker the calls
+    overlap with the caller's own work.  If a call raises an exception, it's
+    raised when its result would be yielded.
+
+    Running API requests in several workers only helps when each request
+    spends most of its time waiting on a slow network.  The API's rate limit
+    applies to all of a user's requests together, so it won't make
+    rate-limited requests any faster.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        try:
+            for item in iterable:
+                pending.append(executor.submit(func, item))
+                if len(pending) > workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            # If we stopped early, don't start calls nobody will see
+            for future in pending:
+                future.cancel()
+
+
+def json_dumps(obj):
+    """
+    Encode an object as JSON, returning UTF-8 bytes that are ready to be sent
+    as a request body or written to a file.  This uses orjson if it is
+    available.  Either way, the JSON is compact, with no spaces after
+    separators, and non-ASCII characters are written as UTF-8, not escaped.
+
+    orjson can't encode integers that don't fit in 64 bits, so objects that
+    it can't encode are encoded with the standard library instead.  (One
+    difference remains: orjson encodes NaN and infinity as `null`, where the
+    standard library writes `NaN` and `Infinity`, which aren't valid JSON.)
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            pass
+    return json.dumps(
+        obj, ensure_ascii=False, separators=(',', ':')
+    ).encode('utf-8')
+
+
+def json_loads(data):
+    """
+    Decode JSON from a string or from UTF-8 bytes.  This uses orjson if it is
+    available.
+
+    orjson decodes integers that don't fit in 64 bits as floats, losing
+    precision, where the standard library keeps them exact.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _is_unencoded(value):
+    """
+    Whether a parameter value can be sent as it is: a string or an integer,
+    including subclasses such as numpy.str_, but not a boolean.
+    """
+    return isinstance(value, (int, str)) and type(value) is not bool
+
+
 def jsonify_parameters(params):
     """
     When sent in an authorized REST request, only strings and integers can be
     transmitted accurately. Other types of data need to be encoded into JSON.
+
+    Booleans count as other types: they are sent as JSON `true` and `false`,
+    not as Python's `True` and `False`.
     """
+    # Most requests have no parameters, or only strings and integers, in which
+    # case there's nothing to encode
+    if all(_is_unencoded(value) for value in params.values()):
+        return params
     result = {}
     for param, value in params.items():
-        if isinstance(value, (int, str)):
+        if _is_unencoded(value):
             result[param] = value
         else:
-            result[param] = json.dumps(value)
+            result[param] = json_dumps(value).decode('utf-8')
     return result
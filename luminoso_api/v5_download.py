@@ -1,15 +1,17 @@
 import argparse
-import json
 import sys
 import os
 from tqdm import tqdm
 
-from .v5_client import LuminosoClient
+from .v5_client import LuminosoClient, json_dumps, map_in_threads
+from .v5_cli import positive_int
 from .v5_constants import URL_BASE
 
 
 DESCRIPTION = 'Download documents from a Luminoso project via the command line.'
 DOCS_PER_BATCH = 1000
+# How many bytes of output download_docs buffers before writing to the file
+WRITE_BUFFER_SIZE = 1 << 20
 
 # The fields we want for "concise" or "expanded" downloads
 CONCISE_FIELDS = ['title', 'text', 'metadata']
@@ -24,7 +26,23 @@ def _sanitize_filename(filename):
     return filename.replace('/', '_').replace(' ', '_')
 
 
-def iterate_docs(client, expanded=False, progress=False):
+def _fetch_batches(client, num_docs, fields, workers=1,
+                   batch_size=DOCS_PER_BATCH):
+    """
+    Yield the lists of documents in a project, one batch of `batch_size` at a
+    time, in order.  The next `workers` batches are requested in the
+    background while the caller handles the current one, so that waiting for
+    the API overlaps with writing the documents out.
+    """
+    def fetch(offset):
+        return client.get('docs', offset=offset, limit=batch_size,
+                          fields=fields)['result']
+
+    return map_in_threads(fetch, range(0, num_docs, batch_size), workers)
+
+
+def iterate_docs(client, expanded=False, progress=False, workers=1,
+                 batch_size=DOCS_PER_BATCH):
     """
     Yield each document in a Luminoso project in turn. Requires a client whose
     URL points to a project.
@@ -36,35 +54,46 @@ def iterate_docs(client, expanded=False, progress=False):
     document: 'title', 'text', and 'metadata'.
 
     Shows a progress bar if progress=True.
+
+    If `workers` is more than 1, that many batches of documents are requested
+    at the same time.  (See map_in_threads in v5_client for when that helps.)
+
+    Each request asks for `batch_size` documents.  Fewer, larger requests
+    spend less time in round trips, as long as the server allows a limit
+    that large.
     """
     # Get total number of docs from the project record
     num_docs = client.get()['document_count']
+    # Encode the fields as JSON once, instead of in every request, so that
+    # jsonify_parameters can pass the request's parameters through as-is
+    fields = EXPANDED_FIELDS if expanded else CONCISE_FIELDS
+    fields = json_dumps(fields).decode('utf-8')
     progress_bar = None
     try:
         if progress:
             progress_bar = tqdm(desc='Downloading documents', total=num_docs)
 
-        for offset in range(0, num_docs, DOCS_PER_BATCH):
-            response = client.get(
-                'docs', offset=offset, limit=DOCS_PER_BATCH,
-                fields=EXPANDED_FIELDS if expanded else CONCISE_FIELDS
-            )
-            docs = response['result']
-            for doc in docs:
-                if progress:
-                    progress_bar.update()
-                yield doc
+        batches = _fetch_batches(client, num_docs, fields, workers=workers,
+                                 batch_size=batch_size)
+        for docs in batches:
+            yield from docs
+            if progress:
+                progress_bar.update(len(docs))
 
     finally:
         if progress:
             progress_bar.close()
 
 
-def download_docs(client, output_filename=None, expanded=False):
+def download_docs(client, output_filename=None, expanded=False, workers=1,
+                  batch_size=DOCS_PER_BATCH):
     """
     Given a LuminosoClient pointing to a project and a filename to write to,
     retrieve all its documents in batches, and write them to a JSON lines
     (.jsons) file with one document per line.
+
+    `workers` is how many batches to request at once, and `batch_size` is how
+    many documents each batch holds, as for iterate_docs.
     """
     if output_filename is None:
         # Find a default filename to download to, based on the project name.
@@ -80,9 +109,12 @@ def download_docs(client, output_filename=None, expanded=False):
 
         print('Downloading project to {!r}'.format(output_filename))
 
-    with open(output_filename, 'w', encoding='utf-8') as out:
-        for doc in iterate_docs(client, expanded=expanded, progress=True):
-            print(json.dumps(doc, ensure_ascii=False), file=out)
+    # json_dumps encodes each document straight to UTF-8 bytes
+    with open(output_filename, 'wb', buffering=WRITE_BUFFER_SIZE) as out:
+        docs = iterate_docs(client, expanded=expanded, progress=True,
+                            workers=workers, batch_size=batch_size)
+        for doc in docs:
+            out.write(json_dumps(doc) + b'\n')
 
 
 def _main(argv):
@@ -107,6 +139,21 @@ def _main(argv):
              ' document vectors',
         action='store_true',
     )
+    parser.add_argument(
+        '-n',
+        '--workers',
+        type=positive_int,
+        default=1,
+        help='How many batches of documents to download at once. Default: 1',
+    )
+    parser.add_argument(
+        '-s',
+        '--batch-size',
+        type=positive_int,
+        default=DOCS_PER_BATCH,
+        help='How many documents to download in each request. Default: %d'
+             % DOCS_PER_BATCH,
+    )
     parser.add_argument(
         'project_id', help='The ID of the project in the Daylight API'
     )
@@ -121,7 +168,8 @@ def _main(argv):
         user_agent_suffix='lumi-download'
     )
     proj_client = client.client_for_path('projects/{}'.format(args.project_id))
-    download_docs(proj_client, args.output_file, args.expanded)
+    download_docs(proj_client, args.output_file, args.expanded,
+                  workers=args.workers, batch_size=args.batch_size)
 
 
 def main():
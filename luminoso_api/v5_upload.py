@@ -1,34 +1,42 @@
 import argparse
-import json
+import logging
+import mmap
+import os
+import queue
+import random
+import requests
+import threading
 import time
 import sys
-from itertools import islice, chain
+from requests.packages.urllib3.exceptions import ProtocolError
 from tqdm import tqdm
 
-from .v5_client import LuminosoClient
-from .errors import LuminosoServerError
+from .v5_client import LuminosoClient, json_dumps, json_loads, map_in_threads
+from .errors import LuminosoError, LuminosoServerError, LuminosoTimeoutError
+from .v5_cli import positive_int
 from .v5_constants import URL_BASE
 
+logger = logging.getLogger(__name__)
+
 
 DESCRIPTION = 'Create a Luminoso project from documents in a file.'
 
 # These fields (and only these fields) must exist on every uploaded document.
 UPLOAD_FIELDS = ['title', 'text', 'metadata']
+# The most documents, and roughly the most bytes of encoded documents, to
+# upload in one request
 BATCH_SIZE = 1000
-
-# http://code.activestate.com/recipes/303279-getting-items-in-batches/
-# Updated for Python 3.5+ by catching StopIteration
-def _batches(iterable, size):
-    """
-    Take an iterator and yield its contents in groups of `size` items.
-    """
-    sourceiter = iter(iterable)
-    while True:
-        try:
-            batchiter = islice(sourceiter, size)
-            yield chain([next(batchiter)], batchiter)
-        except StopIteration:
-            return
+BATCH_BYTES = 8 << 20
+# How many bytes of a JSON lines file to read at a time, and how large a file
+# has to be before we memory-map it instead
+READ_CHUNK_SIZE = 1 << 20
+MMAP_THRESHOLD = 64 << 20
+# How many encoded batches lumi-upload will have ready ahead of the uploads
+READ_AHEAD_BATCHES = 4
+# How many times to try uploading a batch before giving up, and the longest
+# we'll wait between tries, in seconds
+UPLOAD_ATTEMPTS = 6
+MAX_RETRY_WAIT = 60
 
 
 def _simplify_doc(doc):
@@ -46,19 +54,193 @@ def _simplify_doc(doc):
     }
 
 
+def _chunked_lines(infile):
+    """
+    Yield the lines of a binary file, reading it a large chunk at a time.
+    """
+    remainder = b''
+    for chunk in iter(lambda: infile.read(READ_CHUNK_SIZE), b''):
+        lines = (remainder + chunk).split(b'\n')
+        remainder = lines.pop()
+        yield from lines
+    yield remainder
+
+
+def _mapped_lines(infile):
+    """
+    Yield the lines of a binary file by memory-mapping it, which lets the
+    operating system read ahead and saves copying the file through a buffer.
+    """
+    with mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        # madvise() isn't available on every platform
+        if hasattr(mapped, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+            mapped.madvise(mmap.MADV_SEQUENTIAL)
+        yield from iter(mapped.readline, b'')
+
+
 def iterate_json_lines(filename):
     """
     Get an iterator of the JSON objects in a JSON lines file.
+
+    The file is read as bytes and split into lines without decoding it first;
+    the JSON decoder handles the UTF-8 itself.  Large files are memory-mapped.
+    Blank lines are skipped.
+    """
+    with open(filename, 'rb') as infile:
+        size = os.fstat(infile.fileno()).st_size
+        if size and size >= MMAP_THRESHOLD:
+            lines = _mapped_lines(infile)
+        else:
+            lines = _chunked_lines(infile)
+        for line in lines:
+            if line.strip():
+                yield json_loads(line)
+
+
+def _encoded_batches(docs):
+    """
+    Simplify documents and encode them as the JSON bodies of upload requests,
+    yielding (body, number of documents) pairs.
+
+    A batch ends when it reaches BATCH_SIZE documents or BATCH_BYTES bytes,
+    whichever comes first, so that documents with a lot of text don't make
+    for huge requests.  Each document is encoded once, as soon as it is
+    simplified, and the encoded documents are joined into the body.
     """
-    for line in open(filename, encoding='utf-8'):
-        yield json.loads(line)
+    encoded = []
+    nbytes = 0
+    for doc in docs:
+        doc_json = json_dumps(_simplify_doc(doc))
+        if encoded and nbytes + len(doc_json) > BATCH_BYTES:
+            yield b'{"docs":[%s]}' % b','.join(encoded), len(encoded)
+            encoded = []
+            nbytes = 0
+        encoded.append(doc_json)
+        nbytes += len(doc_json) + 1
+        if len(encoded) == BATCH_SIZE:
+            yield b'{"docs":[%s]}' % b','.join(encoded), len(encoded)
+            encoded = []
+            nbytes = 0
+    if encoded:
+        yield b'{"docs":[%s]}' % b','.join(encoded), len(encoded)
+
+
+def _never_received(error):
+    """
+    Whether an upload that failed with `error` certainly never reached the
+    server, so that sending it again can't add the same documents twice.
+
+    That's the case when no connection could be made, or when the server
+    turned the request away as unavailable (503) or rate-limited (429).  A
+    timeout while waiting for a response, a dropped connection, or another
+    server error can happen after the server has accepted the documents, so
+    those aren't retried.
+    """
+    if isinstance(error, LuminosoTimeoutError):
+        return isinstance(error.__cause__, requests.ConnectTimeout)
+    if isinstance(error, LuminosoError):
+        return getattr(error, 'status_code', None) in (429, 503)
+    # A connection that was dropped while the request was being sent or
+    # answered shows up as a ProtocolError inside the ConnectionError
+    return not (error.args and isinstance(error.args[0], ProtocolError))
+
+
+def _upload_batch(proj_client, body):
+    """
+    Upload one batch of documents, already encoded by _encoded_batches, to a
+    project.  If the client compresses requests, the batch is sent
+    gzip-compressed.
+
+    A batch that couldn't reach the server, because of a connection problem
+    or because the server was unavailable or rate-limited, is tried again,
+    waiting about twice as long after each failure, so that a transient
+    problem doesn't abort a long upload.  Other failures aren't retried,
+    because the server may have received the documents anyway.
+    """
+    backoff = 1
+    for attempt in range(1, UPLOAD_ATTEMPTS + 1):
+        try:
+            return proj_client.post_data('upload', body, 'application/json')
+        except (LuminosoError, requests.ConnectionError) as e:
+            if attempt == UPLOAD_ATTEMPTS or not _never_received(e):
+                raise
+            # Wait a random part of the backoff, so that several workers
+            # that failed at once don't all try again at the same moment.
+            # (This isn't for security, so the random module is fine.)
+            delay = random.uniform(0, backoff)  # nosec B311
+            logger.warning('Uploading a batch failed (%r); trying again in'
+                           ' %.1f seconds', e, delay)
+            time.sleep(delay)
+            backoff = min(backoff * 2, MAX_RETRY_WAIT)
+
+
+def _read_ahead(iterable, size):
+    """
+    Iterate over `iterable` in a background thread, keeping up to `size` of
+    its items ready, so that producing the items (such as parsing them from a
+    file) overlaps with whatever the caller does with them (such as uploading
+    them).  An exception raised by the iterable is re-raised to the caller.
+    """
+    items = queue.Queue(maxsize=size)
+    stopped = threading.Event()
+    errors = []
+    end = object()
+
+    def produce():
+        try:
+            for item in iterable:
+                items.put(item)
+                if stopped.is_set():
+                    return
+        except Exception as e:
+            errors.append(e)
+        items.put(end)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        yield from iter(items.get, end)
+    finally:
+        # If the caller stopped early, unblock the producer so that it can
+        # notice and exit
+        stopped.set()
+        while thread.is_alive():
+            try:
+                items.get(timeout=0.1)
+            except queue.Empty:
+                pass
+    if errors:
+        raise errors[0]
 
 
 def create_project_with_docs(
-    client, docs, language, name, workspace=None, progress=False
+    client, docs, language, name, workspace=None, progress=False,
+    compress=False, workers=1
 ):
     """
     Given an iterator of documents, upload them as a Luminoso project.
+
+    If `compress` is True, or the client was connected with compress=True,
+    batches of documents are sent gzip-compressed, which saves bandwidth on
+    slow connections.
+
+    If `workers` is more than 1, that many batches are uploaded at the same
+    time.  (See map_in_threads in v5_client for when that helps.)
+    """
+    return _create_project_with_batches(
+        client, _encoded_batches(docs), language, name, workspace=workspace,
+        progress=progress, compress=compress, workers=workers
+    )
+
+
+def _create_project_with_batches(
+    client, batches, language, name, workspace=None, progress=False,
+    compress=False, workers=1
+):
+    """
+    Create a project and upload documents to it, given an iterator of batches
+    of documents encoded by _encoded_batches.  The other arguments are as for
+    create_project_with_docs.
     """
     description = 'Uploaded using lumi-upload at {}'.format(time.asctime())
     if workspace is not None:
@@ -75,23 +257,33 @@ def create_project_with_docs(
         )
     proj_id = proj_record['project_id']
     proj_client = client.client_for_path('projects/' + proj_id)
+    # Compress the uploads if we were asked to, as well as if the client
+    # already compresses its requests
+    proj_client.compress = proj_client.compress or compress
     try:
         if progress:
             progress_bar = tqdm(desc='Uploading documents')
         else:
             progress_bar = None
 
-        for batch in _batches(docs, BATCH_SIZE):
-            docs_to_upload = [_simplify_doc(doc) for doc in batch]
-            proj_client.post('upload', docs=docs_to_upload)
+        def upload(batch):
+            body, ndocs = batch
+            _upload_batch(proj_client, body)
+            return ndocs
+
+        if workers > 1:
+            uploaded = map_in_threads(upload, batches, workers)
+        else:
+            uploaded = map(upload, batches)
+        for ndocs in uploaded:
             if progress:
-                progress_bar.update(BATCH_SIZE)
+                progress_bar.update(ndocs)
 
     finally:
         if progress:
             progress_bar.close()
 
-    print('The server is building project {!r}.'.format(proj_id))
+    logger.info('The server is building project %r.', proj_id)
     proj_client.post('build')
 
     while True:
@@ -105,15 +297,20 @@ def create_project_with_docs(
 
 
 def upload_docs(
-    client, input_filename, language, name, workspace=None, progress=False
+    client, input_filename, language, name, workspace=None, progress=False,
+    compress=False, workers=1
 ):
     """
     Given a LuminosoClient pointing to the root of the API, and a filename to
     read JSON lines from, create a project from the documents in that file.
     """
+    # Read, parse, and encode batches of documents in a separate thread, while
+    # the batches that are already encoded are being uploaded
     docs = iterate_json_lines(input_filename)
-    return create_project_with_docs(
-        client, docs, language, name, workspace=workspace, progress=progress
+    batches = _read_ahead(_encoded_batches(docs), READ_AHEAD_BATCHES)
+    return _create_project_with_batches(
+        client, batches, language, name, workspace=workspace,
+        progress=progress, compress=compress, workers=workers
     )
 
 
@@ -148,6 +345,25 @@ def _main(argv):
         default='en',
         help='The language code for the language the text is in. Default: en',
     )
+    parser.add_argument(
+        '-z',
+        '--compress',
+        action='store_true',
+        help='Send the documents gzip-compressed, to save bandwidth',
+    )
+    parser.add_argument(
+        '-n',
+        '--workers',
+        type=positive_int,
+        default=1,
+        help='How many batches of documents to upload at once. Default: 1',
+    )
+    parser.add_argument(
+        '-q',
+        '--quiet',
+        action='store_true',
+        help='Only show warnings and errors, with no progress bar',
+    )
     parser.add_argument(
         'input_filename',
         help='The JSON-lines (.jsons) file of documents to upload',
@@ -159,6 +375,10 @@ def _main(argv):
         help='What the project should be called',
     )
     args = parser.parse_args(argv)
+    logging.basicConfig(
+        format='%(message)s',
+        level=logging.WARNING if args.quiet else logging.INFO,
+    )
 
     client = LuminosoClient.connect(
         url=args.base_url, token_file=args.token_file,
@@ -178,7 +398,9 @@ def _main(argv):
         args.language,
         name,
         workspace=args.workspace_id,
-        progress=True,
+        progress=not args.quiet,
+        compress=args.compress,
+        workers=args.workers,
     )
     print(
         'Project {!r} created with {} documents'.format(
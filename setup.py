@@ -29,10 +29,14 @@ setup(
     long_description_content_type="text/markdown",
     classifiers=classifiers,
     packages=find_packages(exclude=('tests',)),
+    python_requires='>=3.7',
     install_requires=[
         'requests >= 1.2.1, < 3.0',
         'tqdm',
     ],
+    extras_require={
+        'fast': ['orjson >= 3'],
+    },
     tests_require=['pytest', 'requests-mock'],
     entry_points={
         'console_scripts': [
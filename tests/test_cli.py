@@ -0,0 +1,81 @@
+from luminoso_api import v5_download, v5_upload
+from luminoso_api.v5_cli import _main, _print_csv, _read_params, positive_int
+from luminoso_api.v5_client import LuminosoClient
+
+import argparse
+import contextlib
+import io
+import json
+import pytest
+import tempfile
+
+BASE_URL = 'http://mock-api.localhost/api/v5/'
+RESULT = [{'b': 'x', 'a': 1}, {'a': 2, 'b': 'é'}]
+
+
+def test_print_csv(capsys):
+    # The test's stdout has a binary buffer underneath it, like a terminal
+    # or a pipe does
+    _print_csv(RESULT)
+    assert capsys.readouterr().out == 'a,b\r\n1,x\r\n2,é\r\n'
+
+    with pytest.raises(TypeError):
+        _print_csv({'a': 1})
+
+
+def test_print_csv_text_only():
+    # In IDLE or Jupyter, or when redirected to a StringIO, stdout has no
+    # binary buffer
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        _print_csv(RESULT)
+    assert out.getvalue() == 'a,b\r\n1,x\r\n2,é\r\n'
+
+
+def test_read_params():
+    input_file = io.StringIO('{"a": 1, "b": [2], "c": "file"}')
+    params = _read_params(input_file, '{"c": "json", "d": null}',
+                          ['d=param', 'e=x=y'])
+    assert params == {'a': 1, 'b': [2], 'c': 'json', 'd': 'param',
+                      'e': 'x=y'}
+
+    with pytest.raises(ValueError, match='key=value'):
+        _read_params(None, None, ['novalue'])
+
+    with pytest.raises(ValueError, match='not valid JSON'):
+        _read_params(None, '{"unfinished": ', [])
+
+
+def test_main(requests_mock, capsys):
+    requests_mock.get(BASE_URL + 'projects/', json=RESULT)
+    with tempfile.TemporaryDirectory() as tempdir:
+        token_file = tempdir + '/tokens.json'
+        LuminosoClient.save_token('fake', domain=BASE_URL,
+                                  token_file=token_file)
+
+        _main('-b', BASE_URL, '-f', token_file, 'get', 'projects',
+              '-p', 'fields=["name"]', '-j', '{"limit": 2}')
+        assert json.loads(capsys.readouterr().out) == RESULT
+        assert requests_mock.last_request.qs == {
+            'fields': ['["name"]'], 'limit': ['2']
+        }
+        assert (requests_mock.last_request.headers['User-Agent']
+                .endswith('lumi-cli'))
+
+        _main('-b', BASE_URL, '-f', token_file, '-c', 'get', 'projects')
+        assert capsys.readouterr().out == 'a,b\r\n1,x\r\n2,é\r\n'
+
+
+def test_positive_int():
+    assert positive_int('3') == 3
+    with pytest.raises(argparse.ArgumentTypeError):
+        positive_int('0')
+    with pytest.raises(ValueError):
+        positive_int('many')
+
+    # lumi-upload and lumi-download reject them before doing anything else
+    for tool_main in (v5_upload._main, v5_download._main):
+        with pytest.raises(SystemExit):
+            tool_main(['-n', '0', 'input', 'output'])
+    with pytest.raises(SystemExit):
+        v5_download._main(['-s', '0', 'projid'])
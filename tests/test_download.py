@@ -128,6 +128,35 @@ def test_pagination(requests_mock):
     docs = list(iterate_docs(client, progress=False))
     assert docs == [REPETITIVE_DOC] * (DOCS_PER_BATCH + 2)
 
+    # Fetching several pages at once still yields the documents in order
+    page2 = [dict(REPETITIVE_DOC, title='Page 2')] * 2
+    requests_mock.get(
+        BASE_URL + ('projects/projid/docs/?offset=%d&limit=%d' %
+                    (DOCS_PER_BATCH, DOCS_PER_BATCH)),
+        json={'result': page2},
+    )
+    docs = list(iterate_docs(client, progress=False, workers=4))
+    assert docs == page1 + page2
+
+
+def test_batch_size(requests_mock):
+    """
+    Test downloading documents in batches of a different size.
+    """
+    requests_mock.get(
+        BASE_URL + 'projects/projid/',
+        json=dict(PROJECT_RECORD, document_count=5),
+    )
+    requests_mock.get(
+        BASE_URL + 'projects/projid/docs/', json={'result': [REPETITIVE_DOC]}
+    )
+    client = LuminosoClient.connect(BASE_URL + 'projects/projid', token='fake')
+    list(iterate_docs(client, progress=False, batch_size=2))
+    history = requests_mock.request_history[1:]
+    assert [(req.qs['offset'], req.qs['limit']) for req in history] == [
+        (['0'], ['2']), (['2'], ['2']), (['4'], ['2'])
+    ]
+
 
 def test_writing(requests_mock):
     """
@@ -0,0 +1,58 @@
+import os
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _run(code):
+    """
+    Run Python code in a fresh interpreter, where luminoso_api hasn't been
+    imported yet, and return what it prints.
+    """
+    result = subprocess.run(
+        [sys.executable, '-c', code], cwd=REPO_DIR, check=True,
+        stdout=subprocess.PIPE, universal_newlines=True
+    )
+    return result.stdout.strip()
+
+
+def test_client_imported_lazily():
+    assert _run(
+        'import sys, luminoso_api\n'
+        'print("luminoso_api.v5_client" in sys.modules)'
+    ) == 'False'
+
+
+def test_client_access():
+    assert _run(
+        'import luminoso_api\n'
+        'print(luminoso_api.LuminosoClient.__name__,'
+        ' luminoso_api.V5LuminosoClient.__name__)'
+    ) == 'LuminosoClient LuminosoClient'
+
+    # Submodules are attributes of the package, as they always have been
+    assert _run(
+        'import luminoso_api\n'
+        'print(luminoso_api.v5_client.LuminosoClient'
+        ' is luminoso_api.LuminosoClient)'
+    ) == 'True'
+
+    assert _run(
+        'from luminoso_api import *\n'
+        'print(LuminosoClient is V5LuminosoClient, LuminosoError.__name__)'
+    ) == 'True LuminosoError'
+
+    assert _run(
+        'import luminoso_api\n'
+        'names = dir(luminoso_api)\n'
+        'print("LuminosoClient" in names, "V5LuminosoClient" in names)'
+    ) == 'True True'
+
+    assert _run(
+        'import luminoso_api\n'
+        'try:\n'
+        '    luminoso_api.nonexistent\n'
+        'except AttributeError:\n'
+        '    print("AttributeError")'
+    ) == 'AttributeError'
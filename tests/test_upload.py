@@ -1,8 +1,17 @@
+from luminoso_api.errors import (
+    LuminosoClientError, LuminosoServerError, LuminosoTimeoutError
+)
 from luminoso_api.v5_client import LuminosoClient
-from luminoso_api.v5_upload import create_project_with_docs, BATCH_SIZE
+from luminoso_api.v5_upload import (
+    create_project_with_docs, iterate_json_lines, upload_docs, BATCH_SIZE
+)
 
 from unittest.mock import patch
+import gzip
+import json
+import tempfile
 import pytest
+import requests
 
 
 BASE_URL = 'http://mock-api.localhost/api/v5/'
@@ -193,3 +202,304 @@ def test_pagination(requests_mock):
         ('GET', BASE_URL + 'projects/projid/'),
         ('GET', BASE_URL + 'projects/projid/'),
     ]
+
+
+def test_upload_from_file(requests_mock):
+    """
+    Test creating a project from a JSON lines file, which is read in a
+    background thread while the documents are uploaded.
+    """
+    requests_mock.post(
+        BASE_URL + 'projects/',
+        json={
+            'project_id': 'projid',
+            'document_count': 0,
+            'language': 'fr',
+            'last_build_info': None,
+        },
+    )
+    requests_mock.post(BASE_URL + 'projects/projid/upload/', json={})
+    requests_mock.post(BASE_URL + 'projects/projid/build/', json={})
+    ndocs = BATCH_SIZE * 3 + 2
+    requests_mock.get(
+        BASE_URL + 'projects/projid/',
+        [_build_info_response(ndocs, 'fr', done=True)],
+    )
+
+    client = LuminosoClient.connect(BASE_URL, token='fake')
+    with tempfile.TemporaryDirectory() as tempdir:
+        input_file = tempdir + '/test.jsons'
+        with open(input_file, 'w', encoding='utf-8') as out:
+            for _ in range(ndocs):
+                print(json.dumps(REPETITIVE_DOC), file=out)
+
+        with patch('time.sleep', return_value=None):
+            upload_docs(client, input_file, language='fr',
+                        name='Projet test', progress=False)
+
+        uploaded = []
+        for req in requests_mock.request_history:
+            if req.url == BASE_URL + 'projects/projid/upload/':
+                uploaded.extend(req.json()['docs'])
+        assert uploaded == [REPETITIVE_DOC] * ndocs
+
+        # A parsing error in the background thread is raised to the caller
+        with open(input_file, 'a', encoding='utf-8') as out:
+            print('{not json', file=out)
+        with pytest.raises(ValueError):
+            upload_docs(client, input_file, language='fr',
+                        name='Projet test', progress=False)
+
+
+def test_concurrent_upload(requests_mock):
+    """
+    Test uploading batches of documents with several workers at once.
+    """
+    requests_mock.post(
+        BASE_URL + 'projects/',
+        json={
+            'project_id': 'projid',
+            'document_count': 0,
+            'language': 'fr',
+            'last_build_info': None,
+        },
+    )
+    requests_mock.post(BASE_URL + 'projects/projid/upload/', json={})
+    requests_mock.post(BASE_URL + 'projects/projid/build/', json={})
+    ndocs = BATCH_SIZE * 5 + 2
+    requests_mock.get(
+        BASE_URL + 'projects/projid/',
+        [_build_info_response(ndocs, 'fr', done=True)],
+    )
+
+    docs = [{'title': 'Document %d' % i, 'text': 'yadda', 'metadata': []}
+            for i in range(ndocs)]
+    client = LuminosoClient.connect(BASE_URL, token='fake')
+    with patch('time.sleep', return_value=None):
+        create_project_with_docs(
+            client,
+            iter(docs),
+            language='fr',
+            name='Projet test',
+            progress=False,
+            workers=3,
+        )
+
+    history = requests_mock.request_history
+    uploads = [req.json()['docs'] for req in history
+               if req.url == BASE_URL + 'projects/projid/upload/']
+    assert len(uploads) == 6
+    # The batches may arrive in any order, but every document arrives once
+    uploaded = sorted(
+        (doc for batch in uploads for doc in batch),
+        key=lambda doc: int(doc['title'].split()[1])
+    )
+    assert uploaded == docs
+    # The build only starts once every batch has been uploaded
+    assert history[7].url == BASE_URL + 'projects/projid/build/'
+
+
+def test_batch_size_in_bytes(requests_mock):
+    """
+    Test that a batch of documents is cut short when it gets too many bytes
+    long, even if it doesn't have BATCH_SIZE documents yet.
+    """
+    requests_mock.post(
+        BASE_URL + 'projects/',
+        json={
+            'project_id': 'projid',
+            'document_count': 0,
+            'language': 'fr',
+            'last_build_info': None,
+        },
+    )
+    requests_mock.post(BASE_URL + 'projects/projid/upload/', json={})
+    requests_mock.post(BASE_URL + 'projects/projid/build/', json={})
+    requests_mock.get(
+        BASE_URL + 'projects/projid/',
+        [_build_info_response(10, 'fr', done=True)],
+    )
+
+    # Each of these documents is 70-80 bytes long when encoded, so only three
+    # fit in 250 bytes
+    doc = {'title': 'Yadda', 'text': 'yadda ' * 5, 'metadata': []}
+    client = LuminosoClient.connect(BASE_URL, token='fake')
+    with patch('time.sleep', return_value=None), \
+            patch('luminoso_api.v5_upload.BATCH_BYTES', 250):
+        create_project_with_docs(
+            client,
+            [doc] * 10,
+            language='fr',
+            name='Projet test',
+            progress=False,
+        )
+
+    uploads = [req.json()['docs'] for req in requests_mock.request_history
+               if req.url == BASE_URL + 'projects/projid/upload/']
+    assert [len(batch) for batch in uploads] == [3, 3, 3, 1]
+    assert all(uploaded == doc for batch in uploads for uploaded in batch)
+
+
+def test_upload_retry(requests_mock):
+    """
+    Test that a batch that the server turned away is uploaded again, and
+    that one that may have been received, or that fails with a client error,
+    is not.
+    """
+    requests_mock.post(
+        BASE_URL + 'projects/',
+        json={
+            'project_id': 'projid',
+            'document_count': 0,
+            'language': 'fr',
+            'last_build_info': None,
+        },
+    )
+    requests_mock.post(
+        BASE_URL + 'projects/projid/upload/',
+        [{'status_code': 503}, {'status_code': 429}, {'json': {}}],
+    )
+    requests_mock.post(BASE_URL + 'projects/projid/build/', json={})
+    requests_mock.get(
+        BASE_URL + 'projects/projid/',
+        [_build_info_response(2, 'fr', done=True)],
+    )
+
+    client = LuminosoClient.connect(BASE_URL, token='fake')
+    with patch('time.sleep', return_value=None):
+        create_project_with_docs(
+            client,
+            DOCS_TO_UPLOAD,
+            language='fr',
+            name='Projet test',
+            progress=False,
+        )
+    reqs = [(req.method, req.url) for req in requests_mock.request_history]
+    assert reqs[:5] == [
+        ('POST', BASE_URL + 'projects/'),
+        ('POST', BASE_URL + 'projects/projid/upload/'),
+        ('POST', BASE_URL + 'projects/projid/upload/'),
+        ('POST', BASE_URL + 'projects/projid/upload/'),
+        ('POST', BASE_URL + 'projects/projid/build/'),
+    ]
+
+    requests_mock.reset_mock()
+    requests_mock.post(BASE_URL + 'projects/projid/upload/', status_code=400)
+    with pytest.raises(LuminosoClientError):
+        with patch('time.sleep', return_value=None):
+            create_project_with_docs(
+                client,
+                DOCS_TO_UPLOAD,
+                language='fr',
+                name='Projet test',
+                progress=False,
+            )
+    assert requests_mock.call_count == 2
+
+    for status_code in (500, 502, 504):
+        requests_mock.reset_mock()
+        requests_mock.post(BASE_URL + 'projects/projid/upload/',
+                           status_code=status_code)
+        with pytest.raises(LuminosoServerError):
+            with patch('time.sleep', return_value=None):
+                create_project_with_docs(
+                    client,
+                    DOCS_TO_UPLOAD,
+                    language='fr',
+                    name='Projet test',
+                    progress=False,
+                )
+        assert requests_mock.call_count == 2
+
+    requests_mock.reset_mock()
+    requests_mock.post(BASE_URL + 'projects/projid/upload/',
+                       exc=requests.exceptions.ReadTimeout)
+    with pytest.raises(LuminosoTimeoutError):
+        create_project_with_docs(
+            client,
+            DOCS_TO_UPLOAD,
+            language='fr',
+            name='Projet test',
+            progress=False,
+        )
+    assert requests_mock.call_count == 2
+
+    requests_mock.reset_mock()
+    requests_mock.post(
+        BASE_URL + 'projects/projid/upload/',
+        [{'exc': requests.exceptions.ConnectTimeout},
+         {'exc': requests.exceptions.ConnectionError}, {'json': {}}],
+    )
+    with patch('time.sleep', return_value=None):
+        create_project_with_docs(
+            client,
+            DOCS_TO_UPLOAD,
+            language='fr',
+            name='Projet test',
+            progress=False,
+        )
+    assert requests_mock.call_count == 6
+
+
+def test_compressed_upload(requests_mock):
+    """
+    Test that documents can be uploaded with a gzip-compressed request body.
+    """
+    requests_mock.post(
+        BASE_URL + 'projects/',
+        json={
+            'project_id': 'projid',
+            'document_count': 0,
+            'language': 'fr',
+            'last_build_info': None,
+        },
+    )
+    requests_mock.post(BASE_URL + 'projects/projid/upload/', json={})
+    requests_mock.post(BASE_URL + 'projects/projid/build/', json={})
+    requests_mock.get(
+        BASE_URL + 'projects/projid/',
+        [_build_info_response(2, 'fr', done=True)],
+    )
+
+    client = LuminosoClient.connect(BASE_URL, token='fake')
+    # Compress even this small upload, which wouldn't usually be worth it
+    with patch('time.sleep', return_value=None), \
+            patch('luminoso_api.v5_client.COMPRESS_MIN_BYTES', 0):
+        create_project_with_docs(
+            client,
+            DOCS_TO_UPLOAD,
+            language='fr',
+            name='Projet test',
+            progress=False,
+            compress=True,
+        )
+
+    upload_request = requests_mock.request_history[1]
+    assert upload_request.url == BASE_URL + 'projects/projid/upload/'
+    assert upload_request.headers['Content-Encoding'] == 'gzip'
+    assert upload_request.headers['Content-Type'] == 'application/json'
+    params = json.loads(gzip.decompress(upload_request.body))
+    assert params['docs'] == DOCS_UPLOADED
+
+
+def test_json_lines_reading():
+    """
+    Test reading a JSON lines file that spans several read chunks, including
+    non-ASCII text, Windows line endings, blank lines, and no final newline.
+    """
+    docs = [{'title': 'Document %d' % i, 'text': 'Ça va? ' * i}
+            for i in range(2000)]
+    with tempfile.TemporaryDirectory() as tempdir:
+        input_file = tempdir + '/test.jsons'
+        with open(input_file, 'w', encoding='utf-8', newline='') as out:
+            for doc in docs:
+                out.write(json.dumps(doc, ensure_ascii=False) + '\r\n')
+            out.write('\n' + json.dumps(REPETITIVE_DOC))
+
+        read_docs = list(iterate_json_lines(input_file))
+        assert read_docs == docs + [REPETITIVE_DOC]
+
+        # Read the same file again, memory-mapping it this time
+        with patch('luminoso_api.v5_upload.MMAP_THRESHOLD', 1):
+            read_docs = list(iterate_json_lines(input_file))
+        assert read_docs == docs + [REPETITIVE_DOC]
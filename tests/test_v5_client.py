@@ -1,11 +1,21 @@
-from luminoso_api.v5_client import LuminosoClient, get_root_url
+from luminoso_api.v5_client import (
+    LuminosoClient, get_root_url, json_dumps, MAX_SHARED_SESSIONS,
+    MAX_SERVER_ERROR_RETRIES, MAX_SERVER_ERROR_WAIT, _SESSIONS
+)
 from luminoso_api.errors import (
     LuminosoClientError, LuminosoServerError, LuminosoError,
     LuminosoTimeoutError
 )
 
+import gzip
+import json
+import os
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from threading import Thread
+from unittest.mock import patch
 import pytest
 import requests
+import tempfile
 
 BASE_URL = 'http://mock-api.localhost/api/v5/'
 
@@ -70,8 +80,10 @@ def test_mock_requests(requests_mock):
     response = client.get('projects')
     assert response == project_list
 
-    # Check that we sent the auth token in the request headers
+    # Check that we sent the auth token and user agent in the request headers
     assert requests_mock.last_request.headers['Authorization'] == 'Token fake'
+    assert (requests_mock.last_request.headers['User-Agent']
+            == client.user_agent)
 
     client2 = client.client_for_path('projects')
     response = client2.get()
@@ -84,6 +96,22 @@ def test_mock_requests(requests_mock):
     assert response == project_list
     assert requests_mock.last_request.qs == {'param': ['value']}
 
+    # Non-string parameters are sent as JSON
+    client2.get(number=1, flag=False, fields=['name'], nothing=None)
+    assert requests_mock.last_request.qs == {
+        'number': ['1'], 'flag': ['false'], 'fields': ['["name"]'],
+        'nothing': ['null']
+    }
+
+    # Subclasses of str and int are sent as they are, like str and int
+    class Name(str):
+        pass
+
+    client2.get(name=Name('x'), flag=True)
+    assert requests_mock.last_request.qs == {
+        'name': ['x'], 'flag': ['true']
+    }
+
     client2.post(param='value')
     assert requests_mock.last_request.method == 'POST'
     assert requests_mock.last_request.json() == {'param': 'value'}
@@ -91,11 +119,52 @@ def test_mock_requests(requests_mock):
     client2.put('projid', param='value')
     assert requests_mock.last_request.method == 'PUT'
     assert requests_mock.last_request.json() == {'param': 'value'}
+    assert (requests_mock.last_request.headers['User-Agent']
+            == client.user_agent)
 
     client2.delete('projid')
     assert requests_mock.last_request.method == 'DELETE'
 
 
+def test_post_bulk(requests_mock):
+    requests_mock.post(BASE_URL + 'projects/projid/upload/', json={})
+    client = LuminosoClient.connect(BASE_URL + 'projects/projid',
+                                    token='fake')
+    docs = [{'text': 'Document %d' % i} for i in range(25)]
+
+    results = client.post_bulk('upload', (doc for doc in docs), batch_size=10)
+    assert results == [{}, {}, {}]
+    history = requests_mock.request_history
+    assert [req.json()['docs'] for req in history] == [
+        docs[:10], docs[10:20], docs[20:]
+    ]
+
+    results = client.post_bulk('upload', docs, batch_size=5, workers=3)
+    assert results == [{}] * 5
+    history = requests_mock.request_history[3:]
+    uploaded = [doc for req in history for doc in req.json()['docs']]
+    assert sorted(uploaded, key=lambda doc: doc['text']) == sorted(
+        docs, key=lambda doc: doc['text']
+    )
+
+
+def test_compressed_requests(requests_mock):
+    requests_mock.post(BASE_URL + 'projects/projid/upload/', json={})
+    client = LuminosoClient.connect(BASE_URL, token='fake', compress=True)
+    project = client.client_for_path('projects/projid')
+
+    # Small bodies aren't worth compressing
+    project.post('upload', docs=[{'text': 'Short'}])
+    assert 'Content-Encoding' not in requests_mock.last_request.headers
+    assert requests_mock.last_request.json() == {'docs': [{'text': 'Short'}]}
+
+    docs = [{'text': 'Document %d' % i} for i in range(1000)]
+    project.post('upload', docs=docs)
+    request = requests_mock.last_request
+    assert request.headers['Content-Encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(request.body)) == {'docs': docs}
+
+
 def test_failing_requests(requests_mock):
     requests_mock.get(BASE_URL + 'bad/', status_code=404)
     requests_mock.get(BASE_URL + 'fail/', status_code=500)
@@ -107,6 +176,154 @@ def test_failing_requests(requests_mock):
     with pytest.raises(LuminosoServerError):
         client.get('fail')
 
+    # The error carries the decoded JSON body if there is one, or else the
+    # body's text
+    requests_mock.get(BASE_URL + 'bad/', status_code=400,
+                      json={'error': 'INVALID', 'message': 'Bad'})
+    with pytest.raises(LuminosoClientError) as e:
+        client.get('bad')
+    assert e.value.args == ({'error': 'INVALID', 'message': 'Bad'},)
+
+    requests_mock.get(BASE_URL + 'fail/', status_code=502, text='Bad gateway')
+    with pytest.raises(LuminosoServerError) as e:
+        client.get('fail')
+    assert e.value.args == ('Bad gateway',)
+
+
+def _serve_statuses(statuses):
+    """
+    Start a local HTTP server that answers each request with the next of the
+    given statuses, and then with 200 and an empty JSON object.  Returns the
+    server, whose `statuses` attribute is the list of statuses still to be
+    sent, and whose `requests` attribute lists the methods it was sent.
+    """
+    statuses = list(statuses)
+
+    class Handler(BaseHTTPRequestHandler):
+        def respond(self):
+            server.requests.append(self.command)
+            length = int(self.headers.get('Content-Length') or 0)
+            self.rfile.read(length)
+            body = b'{}'
+            self.send_response(statuses.pop(0) if statuses else 200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        do_GET = do_POST = respond
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    server.statuses = statuses
+    server.requests = []
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def test_retries():
+    """
+    Test the retries that the session's adapter makes, which requests_mock
+    would bypass, against a real server.
+    """
+    server = _serve_statuses([503] * 100)
+    url = 'http://127.0.0.1:%d/api/v5/' % server.server_port
+    client = LuminosoClient.connect(url, token='fake')
+    try:
+        with patch('time.sleep') as sleep:
+            # A server that stays unavailable is only retried a few times,
+            # with short waits, before its error is raised
+            with pytest.raises(LuminosoServerError):
+                client.get('projects')
+            assert server.requests == ['GET'] * (MAX_SERVER_ERROR_RETRIES + 1)
+            assert sleep.called
+            assert all(call[0][0] <= MAX_SERVER_ERROR_WAIT
+                       for call in sleep.call_args_list)
+
+            # A POST is not repeated
+            del server.requests[:]
+            with pytest.raises(LuminosoServerError):
+                client.post('projects')
+            assert server.requests == ['POST']
+
+            # Rate-limited requests are retried until they get through
+            del server.requests[:]
+            server.statuses[:] = [429, 429]
+            assert client.get('projects') == {}
+            assert server.requests == ['GET'] * 3
+    finally:
+        server.shutdown()
+
+
+def test_json_dumps():
+    # Integers too large for orjson are encoded all the same
+    assert json.loads(json_dumps({'big': 2 ** 70, 1: '\u00e9'})) == {
+        'big': 2 ** 70, '1': '\u00e9'
+    }
+    # The output is the same whether or not orjson is installed
+    assert json_dumps({'a': [1, None]}) == b'{"a":[1,null]}'
+    with pytest.raises(TypeError):
+        json_dumps({1, 2})
+
+
+def test_save_token():
+    with tempfile.TemporaryDirectory() as tempdir:
+        token_file = tempdir + '/luminoso/tokens.json'
+        LuminosoClient.save_token('fake', token_file=token_file)
+        LuminosoClient.save_token(
+            'fake2', domain='https://onsite.example.com/api/v5',
+            token_file=token_file
+        )
+        with open(token_file) as f:
+            assert json.load(f) == {'daylight.luminoso.com': 'fake',
+                                    'onsite.example.com': 'fake2'}
+        # No temporary files are left behind
+        assert os.listdir(tempdir + '/luminoso') == ['tokens.json']
+
+        client = LuminosoClient.connect('https://onsite.example.com/api/v5',
+                                        token_file=token_file)
+        assert client.session.auth.token == 'fake2'
+
+
+def test_shared_session():
+    # Clients connected separately have their own sessions by default
+    client = LuminosoClient.connect(BASE_URL, token='fake')
+    other = LuminosoClient.connect(BASE_URL, token='fake')
+    assert other.session is not client.session
+
+    client = LuminosoClient.connect(BASE_URL, token='fake',
+                                    share_session=True)
+    project = LuminosoClient.connect(BASE_URL + 'projects/projid',
+                                     token='fake', share_session=True)
+    assert project.session is client.session
+    other = LuminosoClient.connect(BASE_URL, token='fake2',
+                                   share_session=True)
+    assert other.session is not client.session
+    assert other.session.auth.token == 'fake2'
+
+    # Only a limited number of shared sessions are kept
+    for i in range(MAX_SHARED_SESSIONS):
+        LuminosoClient.connect(BASE_URL, token='token%d' % i,
+                               share_session=True)
+    assert len(_SESSIONS) == MAX_SHARED_SESSIONS
+    again = LuminosoClient.connect(BASE_URL, token='fake',
+                                   share_session=True)
+    assert again.session is not client.session
+
+
+def test_save_to_file(requests_mock):
+    content = bytes(range(256)) * 1000
+    requests_mock.get(BASE_URL + 'projects/projid/download/', content=content)
+    client = LuminosoClient.connect(BASE_URL, token='fake')
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        filename = tempdir + '/download.xlsx'
+        client.save_to_file('projects/projid/download', filename)
+        with open(filename, 'rb') as f:
+            assert f.read() == content
+
 # Test that passing the timeout value has no impact on a normal request
 def test_timeout_not_timing_out(requests_mock):
     requests_mock.post(BASE_URL + 'projects/', json={})
@@ -177,6 +394,38 @@ def test_wait_for_build(requests_mock):
         client.wait_for_build(interval=.0001)
     assert e.value.args == (build_failed,)
 
+    # The wait between polls grows until it reaches max_interval
+    requests_mock.get(
+        project_url,
+        _last_build_infos_to_mock_returns(
+            [build_running] * 5 + [build_succeeded]
+        )
+    )
+    with patch('time.sleep', return_value=None) as sleep:
+        client.wait_for_build(interval=2, max_interval=5)
+    assert [call.args[0] for call in sleep.call_args_list] == [2, 3, 4.5, 5, 5]
+
+    # Once the server gives the project record an ETag, it's only sent again
+    # when it changes
+    running = {'json': {'last_build_info': build_running},
+               'headers': {'ETag': '"v1"'}}
+    requests_mock.get(project_url, [
+        running, {'status_code': 304}, {'status_code': 304},
+        {'json': {'last_build_info': build_succeeded}}
+    ])
+    result = client.wait_for_build(interval=.0001)
+    assert result == build_succeeded
+    history = requests_mock.request_history[-4:]
+    assert 'If-None-Match' not in history[0].headers
+    assert [req.headers['If-None-Match'] for req in history[1:]] == [
+        '"v1"', '"v1"', '"v1"'
+    ]
+
+    # A response that isn't JSON is an error from the API
+    requests_mock.get(project_url, text='<html>Bad gateway</html>')
+    with pytest.raises(LuminosoError, match='no JSON'):
+        client.wait_for_build(interval=.0001)
+
 
 def test_wait_for_sentiment_build(requests_mock):
     project_url = BASE_URL + 'projects/pr123456/'